@@ -2,26 +2,91 @@
 
 import re
 import argparse
+import hashlib
+import json
+import os
 import subprocess
 import sys
+import time
 from itertools import chain
 import shutil
 from pathlib import Path
-import fitz
-import feedparser
+from typing import NamedTuple
+from xml.etree import ElementTree
 import requests
 
+REF_HEAD_RE = re.compile(r"^\[\d+\]", re.MULTILINE)
+# hyphens ending a line, with the first character of the following line
+LINE_HYPHEN_RE = re.compile(r"(-+)(?:\n|\Z)(?=(.?))")
+# single alphabet is noisy for search
+WORD_RE = re.compile(r'\b(?![Aa]nd\b)[a-zA-Z0-9]{2,}\b')
+# characters dropped from / collapsed into "_" in downloaded file names
+UNSAFE_CHAR_RE = re.compile(r'[^\w\s-]')
+SEPARATOR_RE = re.compile(r'[\s-]+')
+# arXiv IDs cited in the reference text
+ARXIV_REF_RE = re.compile(r"ar-?Xiv:\s?(?P<arxiv_id>[^\s,]+)")
+HEP_TH_RE = re.compile(r"(?P<arxiv_id>hep-th/\d{7,})")
+# new-style (1234.56789) and old-style (hep-th/9901001) identifiers
+CANONICAL_ID_RE = re.compile(r"(\d{4}\.\d{4,5}|[a-z-]+(\.[A-Z]{2})?/\d{7})(v\d+)?")
+
+JNLPAT = (r"((?:[^,]+,[^,]+\((?P<year1>\d+)\)\.)"
+          r"|(?:[^,]+\((?P<year2>\d+)\)\s\d+\.))")
+
+REFPATS = [
+    # case1: the title is surrounded by quotes
+    re.compile(
+        r"^(?P<authors>.*),\s"
+        r"(“|\")(?P<title>.*),(”|\")\s"
+        f"{JNLPAT}"
+    ),
+
+    # case2: the title is not surrounded by quotes
+    re.compile(
+        r"^(?P<authors>(?:.+? and .+?)|(?:[^,]+)),\s"
+        r"(?P<title>.*),\s"
+        f"{JNLPAT}"
+    ),
+
+    # case3: no title, just authors and journal
+    re.compile(
+        r"^(?P<authors>(?:.+? and .+?)|(?:[^,]+)),\s"
+        f"{JNLPAT}"
+    )
+]
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "srxiv"
+CACHE_TTL = 24 * 60 * 60  # seconds
+# bump whenever get_reftxt output changes so stale extractions are dropped
+REFS_CACHE_VERSION = 1
+
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom"}
+
+
+class ArxivEntry(NamedTuple):
+    """A search result from the arXiv API."""
+    id: str
+    title: str
+    authors: tuple  # author names
+
 
 def get_reftxt(pdfpath, refnum: int, findnth=1):
     """Extract reference text from PDF by searching backwards for [refnum]."""
-    with fitz.open(pdfpath) as doc:
+    # PyMuPDF is slow to import and only needed for PDF input
+    import fitz
+
+    # plain text in content-stream order; ligatures such as "ﬁ" are expanded
+    # so that title words stay searchable
+    flags = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
+    with fitz.open(pdfpath, filetype="pdf") as doc:
         # Search pages backwards to find the page containing [refnum]
+        head = re.compile(
+            rf"(^|\.\n)\[{refnum}\]" if refnum > 1 else rf"\n\[{refnum}\]")
         count = 0
         pnum = -1
         for j in range(len(doc) - 1, -1, -1):
-            if (refnum > 1 and re.search(rf"(^|\.\n)\[{refnum}\]", doc[j].get_text())) or \
-               (refnum == 1 and re.search(rf"\n\[{refnum}\]", doc[j].get_text())):
-                pnum = j
+            pagetxt = doc[j].get_text("text", flags=flags, sort=False)
+            if head.search(pagetxt):
+                pnum, pdftxt = j, pagetxt
                 count += 1
                 if count >= findnth:
                     break
@@ -29,91 +94,143 @@ def get_reftxt(pdfpath, refnum: int, findnth=1):
         if pnum == -1:
             return ""
 
-        pdftxt = "".join(
-            page.get_text() for page in doc[pnum:pnum + 2])
+        # the reference may continue on the next page
+        if pnum + 1 < len(doc):
+            pdftxt += doc[pnum + 1].get_text("text", flags=flags, sort=False)
 
-    lines = pdftxt.splitlines()
-    try:
-        ini = next(
-            i for i, line in enumerate(lines)
-            if line.startswith(f"[{refnum}]"))
-    except StopIteration:
-        return ""
+    # Find the line starting with [refnum], then the next reference header
+    needle = f"[{refnum}]"
+    if pdftxt.startswith(needle):
+        ini = len(needle)
+    else:
+        ini = pdftxt.find(f"\n{needle}")
+        if ini == -1:
+            return ""
+        ini += 1 + len(needle)
+    nxt = REF_HEAD_RE.search(pdftxt, ini)
+    block = pdftxt[ini:nxt.start() if nxt else None]
 
-    try:
-        fin = next(
-            i for i, line in enumerate(lines[ini+1:], start=ini+1)
-            if re.match(r"^\[\d+\]", line))
-    except StopIteration:
-        fin = len(lines)
-
-    reftxt = ""
-    for j in range(ini, fin):
-        # this procedure unevitably changes "non-unitary" to "nonunitary"
-        if lines[j].endswith("-"):
-            if j + 1 < fin and lines[j + 1][0].isupper():
-                reftxt += lines[j]  # ex.) non-Hermitian
-            else:
-                reftxt += lines[j].rstrip("-")
-        else:
-            reftxt += lines[j] + " "
+    # Join the lines in one pass over the block. A line-end hyphen is kept
+    # before a capital (ex. non-Hermitian) and dropped otherwise, which
+    # unevitably changes "non-unitary" to "nonunitary".
+    reftxt = LINE_HYPHEN_RE.sub(
+        lambda m: m[1] if m[2].isupper() else "", block).replace("\n", " ")
 
-    return re.sub(r"^\[\d+\]", "", reftxt).strip()
+    return reftxt.strip()
 
 
-def query_arxiv_api(query, max_results=10):
+def cached_reftxt(pdfpath, refnum: int, findnth=1):
+    """Memoize get_reftxt on disk until the PDF file is modified."""
+    pdfpath = Path(pdfpath).resolve()
+    mtime = pdfpath.stat().st_mtime_ns
+    cachepath = CACHE_DIR / "refs.json"
+    try:
+        cache = json.loads(cachepath.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        cache = None
+    # anything unexpected, including an older format, starts a fresh cache
+    if not isinstance(cache, dict) or cache.get("version") != REFS_CACHE_VERSION \
+            or not isinstance(cache.get("pdfs"), dict):
+        cache = {"version": REFS_CACHE_VERSION, "pdfs": {}}
+
+    entry = cache["pdfs"].get(str(pdfpath))
+    if not isinstance(entry, dict) or entry.get("mtime") != mtime \
+            or not isinstance(entry.get("refs"), dict):
+        entry = cache["pdfs"][str(pdfpath)] = {"mtime": mtime, "refs": {}}
+
+    key = f"{refnum}:{findnth}"
+    reftxt = entry["refs"].get(key)
+    if isinstance(reftxt, str) and reftxt:
+        return reftxt
+
+    reftxt = get_reftxt(pdfpath, refnum, findnth)
+    if reftxt:  # failures are retried on the next run
+        entry["refs"][key] = reftxt
+        write_cache(cachepath, json.dumps(cache))
+    return reftxt
+
+
+def query_arxiv_api(query=None, max_results=10, id_list=None):
     """Query the arXiv API with given parameters."""
     req = requests.Request('GET', "https://export.arxiv.org/api/query", params={
         "search_query": query,
+        "id_list": id_list,
         "start": 0,
         "max_results": max_results,
     })
     prepared = req.prepare()
     print(prepared.url)
-    with requests.Session() as s:
-        response = s.send(prepared, timeout=10)
-    response.raise_for_status()
-    return feedparser.parse(response.text).entries
+    try:
+        return fetch_cached(prepared, parse_atom)
+    except ElementTree.ParseError:
+        print("Unexpected response from the arXiv API.")
+        return None
+
+
+def parse_atom(xml):
+    """Extract id, title and author names of each entry in an Atom feed."""
+    return [
+        ArxivEntry(
+            id=entry.findtext("atom:id", "", ATOM_NS).strip(),
+            title=" ".join(entry.findtext("atom:title", "", ATOM_NS).split()),
+            authors=tuple(
+                (name.text or "").strip()
+                for name in entry.iterfind("atom:author/atom:name", ATOM_NS)
+            ),
+        )
+        for entry in ElementTree.fromstring(xml).iterfind("atom:entry", ATOM_NS)
+    ]
+
+
+def fetch_cached(prepared, parse):
+    """Send a prepared request and parse the body, reusing a cached body for a day."""
+    key = hashlib.sha1(prepared.url.encode()).hexdigest()
+    cachepath = CACHE_DIR / f"{key}.xml"
+    if cachepath.exists() and time.time() - cachepath.stat().st_mtime < CACHE_TTL:
+        return parse(cachepath.read_text(encoding="utf-8"))
+
+    try:
+        with requests.Session() as s:
+            response = s.send(prepared, timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        if not cachepath.exists():
+            raise
+        print("Request failed. Using the expired cache.")
+        return parse(cachepath.read_text(encoding="utf-8"))
+
+    result = parse(response.text)  # raises before a bad body reaches the cache
+    write_cache(cachepath, response.text)
+    return result
+
+
+def write_cache(cachepath, text):
+    """Atomically replace a cache file; caching is best-effort."""
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmppath = cachepath.with_suffix(".tmp")
+        tmppath.write_text(text, encoding="utf-8")
+        tmppath.replace(cachepath)
+    except OSError:
+        pass
 
 
 def request_arxiv(reftxt, mode=None, max_results=10):
     """Search arXiv API using reference text or arXiv ID."""
-    id_match = re.search(r"ar-?Xiv:(?P<arxiv_id>[^\s,]+)", reftxt) or \
-        re.search(r"(?P<arxiv_id>hep-th/\d{7,})", reftxt)
+    id_match = ARXIV_REF_RE.search(reftxt) or HEP_TH_RE.search(reftxt)
 
     if id_match:
-        return query_arxiv_api(id_match.group("arxiv_id"), max_results)
-
-    jnlpat = (r"((?:[^,]+,[^,]+\((?P<year1>\d+)\)\.)"
-              r"|(?:[^,]+\((?P<year2>\d+)\)\s\d+\.))")
-
-    refpat = [
-        # case1: the title is surrounded by quotes
-        re.compile(
-            r"^(?P<authors>.*),\s"
-            r"(“|\")(?P<title>.*),(”|\")\s"
-            f"{jnlpat}"
-        ),
-
-        # case2: the title is not surrounded by quotes
-        re.compile(
-            r"^(?P<authors>(?:.+? and .+?)|(?:[^,]+)),\s"
-            r"(?P<title>.*),\s"
-            f"{jnlpat}"
-        ),
-
-        # case3: no title, just authors and journal
-        re.compile(
-            r"^(?P<authors>(?:.+? and .+?)|(?:[^,]+)),\s"
-            f"{jnlpat}"
-        )
-    ]
-
-    if mode is None or not 1 <= mode <= 3:
-        match = refpat[0].match(reftxt) or refpat[1].match(
-            reftxt) or refpat[2].match(reftxt)
+        arxiv_id = id_match.group("arxiv_id").rstrip(".;)]")
+        if CANONICAL_ID_RE.fullmatch(arxiv_id):
+            # fetch the paper itself rather than searching for the ID
+            return query_arxiv_api(id_list=arxiv_id, max_results=1)
+        return query_arxiv_api(arxiv_id, max_results)
+
+    if mode is not None and 1 <= mode <= len(REFPATS):
+        match = REFPATS[mode - 1].match(reftxt)
     else:
-        match = refpat[int(mode) - 1].match(reftxt)
+        match = REFPATS[0].match(reftxt) or REFPATS[1].match(
+            reftxt) or REFPATS[2].match(reftxt)
 
     if not match:
         print("Match failed for the reference text:")
@@ -123,12 +240,10 @@ def request_arxiv(reftxt, mode=None, max_results=10):
     title = match.group("title").strip(
     ) if "title" in match.groupdict() else ""
     authors = match.group("authors").strip()
-    # single alphabet is noisy for search
-    word_pattern = r'\b(?![Aa]nd\b)[a-zA-Z0-9]{2,}\b'
     query = ' '.join(chain(
-        (f'au:{w}' for w in sorted(re.findall(
-            word_pattern, authors), key=len, reverse=True)),
-        re.findall(word_pattern, title)
+        (f'au:{w}' for w in sorted(
+            WORD_RE.findall(authors), key=len, reverse=True)),
+        WORD_RE.findall(title)
     ))
 
     if not query:
@@ -139,33 +254,51 @@ def request_arxiv(reftxt, mode=None, max_results=10):
     return query_arxiv_api(query, max_results)
 
 
+def format_entry(e, j):
+    """Format arXiv entry with title and authors for display."""
+    return (f"\n[{j+1}]  {e.title}\n\n"
+            f"  by {', '.join(e.authors)} ({e.id})\n\n")
+
+
 def print_entry(e, j):
     """Print formatted arXiv entry with title and authors."""
-    print(f"\n[{j+1}]  {e.title}\n")
-    print(f"  by {', '.join(author.name for author in e.authors)} ({e.id})\n")
+    print(format_entry(e, j), end='')
 
 
 def dl_open_pdf(e):
     """Download PDF from arXiv entry and open with mupdf."""
-    arxiv_id = e.id.split('/')[-1]
-    safe_title = re.sub(r'[^\w\s-]', '', e.title)
-    safe_title = re.sub(r'(\s|-)+', '_', safe_title).strip('_')[:40]
+    # keep the archive of old-style IDs (hep-th/9901001 -> hep-th_9901001)
+    # so that papers from different archives never share a file name
+    arxiv_id = e.id.split('/abs/')[-1].replace('/', '_')
+    safe_title = SEPARATOR_RE.sub(
+        '_', UNSAFE_CHAR_RE.sub('', e.title)).strip('_')[:40]
     filepath = Path(f"{arxiv_id}_{safe_title}.pdf")
+    # reuse an earlier download of this version even if its title changed
+    filepath = next(Path().glob(f"{arxiv_id}_*.pdf"), filepath)
 
     if not filepath.exists():
+        # write to a side file so an interrupted download is not reused
+        partpath = filepath.with_name(filepath.name + '.part')
         with requests.get(
                 e.id.replace('/abs/', '/pdf/') + '.pdf',
                 timeout=30, stream=True) as response:
             response.raise_for_status()
-            if not response.content.startswith(b'%PDF'):
+            chunks = response.iter_content(chunk_size=1 << 16)
+            head = next(chunks, b'')
+            if not head.startswith(b'%PDF'):
                 raise ValueError("Downloaded content is not a valid PDF.")
-            filepath.write_bytes(response.content)
+            with partpath.open('wb') as f:
+                f.write(head)
+                for chunk in chunks:
+                    f.write(chunk)
+        partpath.replace(filepath)
         print("Downloaded. ", end='')
 
     if mupdf_path := shutil.which('mupdf'):
         subprocess.Popen(
             [mupdf_path, filepath],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True  # keep the viewer open after we exit
         )
         print(f"Opening {filepath.name} ...")
     else:
@@ -195,8 +328,10 @@ def interactive_search(entries):
                     print("No more entries.")
                     continue
                 remnum = min(5, n - dispnum)
-                for j in range(dispnum, dispnum + remnum):
-                    print_entry(entries[j], j)
+                # one write for the whole page of entries
+                print("".join(
+                    format_entry(entries[j], j)
+                    for j in range(dispnum, dispnum + remnum)), end='')
                 dispnum += remnum
                 continue
 
@@ -243,7 +378,7 @@ def main():
             print("Error: Reference number is required when providing a PDF file.")
             sys.exit(1)
 
-        reftxt = get_reftxt(args.id, args.refnum, args.depth).split(";")[
+        reftxt = cached_reftxt(args.id, args.refnum, args.depth).split(";")[
             args.inner_refnum - 1].strip()
         if not reftxt:
             print("Failed to get reference text.")